@@ -1,17 +1,32 @@
 #!/usr/bin/env python3
 
 import subprocess
+import hashlib
+import copy
 import time
 import sys
 import logging
 import os
-import configparser
+import tomllib
 import boto3
+import botocore
 import socket
+import selectors
+import threading
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config as BotoConfig
 from logging.handlers import TimedRotatingFileHandler, RotatingFileHandler
 
 LOGGER_NAME = 'main'
-CONFIG_FILE = 'config.ini'
+CONFIG_FILE = 'config.toml'
+TABLEAU_PROFILE = '/etc/profile.d/tableau_server.sh'
+TSM_OUTPUT_TAIL_BYTES = 64 * 1024
+TSM_LOG_TAIL_BYTES = 4096
+HEARTBEAT_INTERVAL = 30
+ZABBIX_CONFIG_FILE = '/etc/zabbix/zabbix_agentd.conf'
+HOSTNAME = socket.gethostname()
 POSSIBLE_COMMANDS = ['backup', 'upload']
 HELP_MESSAGE = [
     'The full-backup2s3 is used to start "tsm maintenance backup", upload backups to the S3 and send result to Zabbix.',
@@ -22,6 +37,32 @@ HELP_MESSAGE = [
     '   upload    --  Upload all *.tsbak files in the backup folder to S3 and then remove its',
 ]
 
+MULTIPART_THRESHOLD_MB = 8
+PART_SIZE_MB_DEFAULT = 50
+MAX_CONCURRENCY_DEFAULT = 8
+PARALLEL_FILES_DEFAULT = 4
+
+# Large *.tsbak files are split into parts which are uploaded by a thread pool
+TRANSFER_CFG = TransferConfig(
+    multipart_threshold=MULTIPART_THRESHOLD_MB * 1024 * 1024,
+    multipart_chunksize=PART_SIZE_MB_DEFAULT * 1024 * 1024,
+    max_concurrency=MAX_CONCURRENCY_DEFAULT,
+    use_threads=True,
+    max_io_queue=100,
+)
+
+# One client is shared by all upload threads. S3Wrapper grows the connection
+# pool when parallel_files * max_concurrency requests can be in flight
+BOTO_CFG = BotoConfig(
+    retries={'mode': 'adaptive', 'max_attempts': 10},
+    tcp_keepalive=True,
+    max_pool_connections=32,
+    connect_timeout=5,
+    read_timeout=60,
+)
+
+logger = logging.getLogger(LOGGER_NAME)
+
 
 
 
@@ -65,18 +106,17 @@ def get_timestamp() -> str:
     return time.strftime('%Y%m%d-%H%M%S')
 
 
-def get_config(path: str) -> configparser.ConfigParser:
-    logger = logging.getLogger(LOGGER_NAME)
+def get_config(path: str) -> dict:
     script_dir = os.path.dirname(os.path.realpath(__file__))
     config_path = os.path.join(script_dir, path)
-    config = configparser.ConfigParser()
     logger.debug(f'Reading config file: {path}')
     if not os.path.isfile(config_path):
         msg = f'Config file not found: {path}. Exit'
         logger.debug(msg)
         sys.exit(msg)
     try:
-        config.read(config_path)
+        with open(config_path, 'rb') as f:
+            config = tomllib.load(f)
     except Exception as e:
         logger.exception(e)
         msg = f'Exception while parsing the config file: {path}'
@@ -86,61 +126,230 @@ def get_config(path: str) -> configparser.ConfigParser:
 
 
 def print_help() -> None:
-    [
-        print(i) for i in HELP_MESSAGE
-    ]
-
-
-def send_to_zabbix(key: str, value: int, config_file: str) -> None:
-    logger = logging.getLogger(LOGGER_NAME)
-    args = [
-        'zabbix_sender',
-        '-c',
-        config_file,
-        '-s',
-        socket.gethostname(),
-        '-k',
-        key,
-        '-o',
-        str(value)
-    ]
-    logger.info(f'Send to Zabbix" {key=},  {value=}')
-    logger.debug(f'Running command: {" ".join(args)}')
-    completed_process = subprocess.run(args)
+    sys.stdout.write('\n'.join(HELP_MESSAGE) + '\n')
+
+
+class ZabbixBatcher:
+    """Buffers metrics and sends them to Zabbix with one zabbix_sender run.
+
+    Metrics are added from several upload threads, so the buffer is guarded
+    by a lock. Without config_file metrics are dropped.
+    """
+    def __init__(self, config_file: str = None, hostname: str = HOSTNAME):
+        self.logger = logging.getLogger(f'{LOGGER_NAME}.ZabbixBatcher')
+        self.config_file = config_file
+        self.hostname = hostname
+        self._buf = []
+        self._lock = threading.Lock()
+
+    def add(self, key: str, value: int) -> None:
+        if not self.config_file:
+            return
+        self.logger.info(f'Add to Zabbix batch: {key=}, {value=}')
+        with self._lock:
+            self._buf.append(f'{self.hostname} {key} {value}\n')
+
+    def flush(self) -> None:
+        with self._lock:
+            buf, self._buf = self._buf, []
+        if not buf:
+            return
+        args = [
+            'zabbix_sender',
+            '-c',
+            self.config_file,
+            '-i',
+            '-',
+        ]
+        self.logger.debug(f'Running command: {" ".join(args)}, values: {len(buf)}')
+        completed_process = subprocess.run(args, input=''.join(buf).encode())
+
+
+def load_tableau_env(profile: str = TABLEAU_PROFILE) -> None:
+    """Adds the variables set by the Tableau Server profile script (e.g. PATH to tsm) to os.environ."""
+    if not os.path.isfile(profile):
+        logger.warning(f'{profile} not found, tsm is expected to be in PATH')
+        return
+    logger.debug(f'Loading environment from: {profile}')
+    # Like the former "source ...; tsm ...", a failing command in the profile doesn't stop the backup.
+    # If tsm isn't in PATH after it, start_backup reports exit code 127
+    completed_process = subprocess.run(
+        ['bash', '-c', 'source "$1"; rc=$?; env -0; exit $rc', 'bash', profile],
+        capture_output=True,
+    )
+    if completed_process.returncode != 0:
+        logger.warning(f'{profile} returned {completed_process.returncode}: '
+                       f'{completed_process.stderr.decode(errors="replace").strip()}')
+    for item in completed_process.stdout.split(b'\0'):
+        key, sep, value = item.decode(errors='replace').partition('=')
+        if sep:
+            os.environ[key] = value
+
+
+def read_process_output(
+        process: subprocess.Popen,
+        heartbeat: Callable[[], None] = None,
+        heartbeat_interval: int = HEARTBEAT_INTERVAL,
+) -> tuple[bytes, bytes]:
+    """Logs stdout/stderr of the process while it runs and returns only their tails.
+
+    heartbeat is called every heartbeat_interval seconds until the process closes its output.
+    """
+    next_heartbeat = time.monotonic() + heartbeat_interval
+    tails = {
+        process.stdout: bytearray(),
+        process.stderr: bytearray(),
+    }
+    with selectors.DefaultSelector() as selector:
+        for pipe in tails:
+            selector.register(pipe, selectors.EVENT_READ)
+        while selector.get_map():
+            if heartbeat and time.monotonic() >= next_heartbeat:
+                heartbeat()
+                next_heartbeat = time.monotonic() + heartbeat_interval
+            for key, _ in selector.select(timeout=heartbeat_interval if heartbeat else None):
+                data = os.read(key.fd, 65536)
+                if not data:
+                    selector.unregister(key.fileobj)
+                    continue
+                logger.debug(data.decode(errors='replace').rstrip())
+                tail = tails[key.fileobj]
+                tail += data
+                del tail[:-TSM_OUTPUT_TAIL_BYTES]
+    return bytes(tails[process.stdout]), bytes(tails[process.stderr])
+
+
+def _send_heartbeat(zab_batcher: ZabbixBatcher) -> Callable[[], None]:
+    def send():
+        zab_batcher.add(key='full-backup2s3.heartbeat', value=1)
+        zab_batcher.flush()
+    return send
 
 
 def start_backup(
         backup_file: str,
         append_timestamp: bool = False,
-        multithreaded: bool = False
+        multithreaded: bool = False,
+        zab_batcher: ZabbixBatcher = None,
 ):
-    logger = logging.getLogger(LOGGER_NAME)
     if append_timestamp:
         backup_file += '_' + get_timestamp()
-    args = f'source /etc/profile.d/tableau_server.sh; tsm maintenance backup --ignore-prompt --file {backup_file}'
+    args = ['tsm', 'maintenance', 'backup', '--ignore-prompt', '--file', backup_file]
 
     if multithreaded:
-        args += ' --multithreaded'
-    logger.debug(f'subprocess.run: "{args}"')
+        args.append('--multithreaded')
+    logger.debug(f'subprocess.Popen: "{" ".join(args)}"')
     start_backup_time = time.time()
-    completed_process = subprocess.run(args, capture_output=True, shell=True)
+    try:
+        process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError as e:
+        # e.g. tsm isn't in PATH. Report it like the shell did (exit code 127) so the upload still runs
+        logger.error(f'Cannot run "{args[0]}": {e}')
+        return 127, b'', str(e).encode(), int(time.time() - start_backup_time)
+    with process:
+        stdout, stderr = read_process_output(
+            process,
+            heartbeat=_send_heartbeat(zab_batcher) if zab_batcher else None,
+        )
+        returncode = process.wait()
     tsm_backup_duration_time = int(time.time() - start_backup_time)
     return (
-        completed_process.returncode,
-        completed_process.stdout.decode(),
-        completed_process.stderr.decode(),
+        returncode,
+        stdout,
+        stderr,
         tsm_backup_duration_time
     )
 
 
+class HashingReader:
+    """Read-only file object wrapper which hashes the data while boto3 reads it.
+
+    s3transfer reads a seekable file object sequentially, so the file is read
+    from the disk only once. Data which is read again (e.g. a retried request)
+    isn't hashed twice.
+    """
+    def __init__(self, fileobj, hash_obj):
+        self._fileobj = fileobj
+        self._hash = hash_obj
+        self._hashed_bytes = 0
+
+    def read(self, size: int = -1) -> bytes:
+        position = self._fileobj.tell()
+        data = self._fileobj.read(size)
+        end = position + len(data)
+        if position <= self._hashed_bytes < end:
+            self._hash.update(memoryview(data)[self._hashed_bytes - position:])
+            self._hashed_bytes = end
+        return data
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        return self._fileobj.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._fileobj.tell()
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def close(self) -> None:
+        # s3transfer closes the file object after a non-multipart upload.
+        # The wrapped file is owned (and closed) by the caller
+        pass
+
+    def hexdigest(self) -> str:
+        file_size = os.fstat(self._fileobj.fileno()).st_size
+        if self._hashed_bytes != file_size:
+            raise ValueError(f'Only {self._hashed_bytes} of {file_size} bytes were hashed')
+        return self._hash.hexdigest()
+
+
 class S3Wrapper:
-    def __init__(self,):
+    def __init__(
+            self,
+            max_concurrency: int = None,
+            part_size_mb: int = None,
+            parallel_files: int = PARALLEL_FILES_DEFAULT,
+    ):
         self.logger = logging.getLogger(f'{LOGGER_NAME}.S3Wrapper')
 
+        self.transfer_config = TRANSFER_CFG
+        if max_concurrency or part_size_mb:
+            self.transfer_config = TransferConfig(
+                multipart_threshold=MULTIPART_THRESHOLD_MB * 1024 * 1024,
+                multipart_chunksize=(part_size_mb or PART_SIZE_MB_DEFAULT) * 1024 * 1024,
+                max_concurrency=max_concurrency or MAX_CONCURRENCY_DEFAULT,
+                use_threads=True,
+                max_io_queue=100,
+            )
+        self.logger.debug(f'TransferConfig: {self.transfer_config.multipart_chunksize=}, '
+                          f'{self.transfer_config.max_concurrency=}')
+
+        # upload_fileobj() reads every part of a file object into memory (10 parts by default).
+        # Not more parts than are uploaded at the same time are kept, i.e. max_concurrency * part size per file
+        self.fileobj_transfer_config = copy.copy(self.transfer_config)
+        self.fileobj_transfer_config.max_in_memory_upload_chunks = self.transfer_config.max_concurrency
+
+        # Every part upload of every file in flight holds its own connection
+        max_pool_connections = max(
+            BOTO_CFG.max_pool_connections,
+            parallel_files * self.transfer_config.max_concurrency,
+        )
         self.s3_client = boto3.client(
             service_name='s3',
+            config=BOTO_CFG.merge(BotoConfig(max_pool_connections=max_pool_connections)),
         )
 
+    def warm_up(self, bucket: str) -> None:
+        # Opens the first connection of the pool before the uploads start.
+        # HeadBucket needs s3:ListBucket, so 403 is expected with the minimal policy
+        try:
+            self.s3_client.head_bucket(Bucket=bucket)
+        except botocore.exceptions.ClientError as e:
+            self.logger.debug(f'head_bucket: {e}')
+
     def put_object(
             self,
             body: str,
@@ -168,42 +377,92 @@ class S3Wrapper:
             ExtraArgs={
                 "ChecksumAlgorithm": "SHA256"
             },
+            Config=self.transfer_config,
         )
         self.logger.debug(f'End upload upload: "{file}"')
         return resp
 
-    def upload_file_with_md5sum(
+    def upload_fileobj(
             self,
-            file: str,
+            fileobj,
             bucket: str,
             key: str,
     ):
-        filedir, filename = file.rsplit('/', 1)
-        self.logger.info(f'Start calculate md5sum for: "{file}"')
-        process = subprocess.Popen([
-            'md5sum',
-            filename,
-        ],
-            cwd=filedir,
-            stdout=subprocess.PIPE
-        )
-        resp = self.upload_file(
-            file=file,
-            bucket=bucket,
-            key=key,
+        self.logger.info(f'Start upload upload: "{key}" in "{bucket}"')
+        resp = self.s3_client.upload_fileobj(
+            Fileobj=fileobj,
+            Bucket=bucket,
+            Key=key,
+            ExtraArgs={
+                "ChecksumAlgorithm": "SHA256"
+            },
+            Config=self.fileobj_transfer_config,
         )
-        md5sum_output = [l.decode() for l in process.communicate() if l]
-        md5sum = ''.join(md5sum_output)
-        self.logger.info(f'md5sum: "{md5sum}"')
+        self.logger.debug(f'End upload upload: "{key}"')
+        return resp
 
-        md5sum_filename = f'{filename}.md5sum.txt'
-        self.logger.info(f'Uploading md5sum: "{md5sum_filename}" to "{bucket}"')
+    def get_checksum_sha256(
+            self,
+            bucket: str,
+            key: str,
+    ) -> str | None:
+        try:
+            resp = self.s3_client.head_object(
+                Bucket=bucket,
+                Key=key,
+                ChecksumMode='ENABLED',
+            )
+        except botocore.exceptions.ClientError as e:
+            self.logger.warning(f'Cannot get ChecksumSHA256 of "{key}": {e}')
+            return None
+        return resp.get('ChecksumSHA256')
+
+    def upload_file_with_sha256sum(
+            self,
+            file: str,
+            bucket: str,
+            key: str,
+            sha256sum_file: bool = True,
+    ) -> str:
+        """Uploads the file and returns its checksum.
+
+        With sha256sum_file the SHA-256 of the file is calculated while it's uploaded and
+        saved in "<filename>.sha256.txt", otherwise the checksum stored by S3 is returned.
+        """
+        filename = os.path.basename(file)
+        fd = os.open(file, os.O_RDONLY)
+        with os.fdopen(fd, 'rb') as f:
+            if sha256sum_file:
+                reader = HashingReader(f, hashlib.sha256())
+                self.upload_fileobj(
+                    fileobj=reader,
+                    bucket=bucket,
+                    key=key,
+                )
+                sha256sum = f'{reader.hexdigest()}  {filename}\n'
+            else:
+                self.upload_file(
+                    file=file,
+                    bucket=bucket,
+                    key=key,
+                )
+            if hasattr(os, 'posix_fadvise'):
+                # The backup won't be read again, don't let it push other data out of the page cache
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        s3_checksum = self.get_checksum_sha256(bucket=bucket, key=key)
+        self.logger.info(f'S3 ChecksumSHA256: "{s3_checksum}"')
+        if not sha256sum_file:
+            return s3_checksum
+
+        self.logger.info(f'sha256sum: "{sha256sum}"')
+        sha256sum_filename = f'{filename}.sha256.txt'
+        self.logger.info(f'Uploading sha256sum: "{sha256sum_filename}" to "{bucket}"')
         self.put_object(
-            body=md5sum,
+            body=sha256sum,
             bucket=bucket,
-            key=md5sum_filename
+            key=sha256sum_filename
         )
-        return md5sum
+        return sha256sum
 
 
 def main():
@@ -219,34 +478,34 @@ def main():
     config = get_config(CONFIG_FILE)
     backup_conf = config['Backup']
     aws_conf = config['AWS']
-    zab_conf = config['Zabbix'] if 'Zabbix' in config.sections() else None
+    zab_conf = config.get('Zabbix')
 
-    if 'Logging' in config.sections():
+    if 'Logging' in config:
         log_conf = config['Logging']
         init_filelogger(
             name=LOGGER_NAME,
             filename=log_conf['filename'],
-            max_bytes=log_conf.getint('max_bytes'),
-            backup_count=log_conf.getint('backup_count'),
-            debug=log_conf.getboolean('debug')
+            max_bytes=log_conf['max_bytes'],
+            backup_count=log_conf['backup_count'],
+            debug=log_conf.get('debug', False)
         )
 
+    zab_batcher = ZabbixBatcher(config_file=zab_conf.get('config_file', ZABBIX_CONFIG_FILE) if zab_conf else None)
+
     # BACKUP
     if sys.argv[1] == 'backup':
-        if zab_conf:
-            send_to_zabbix(
-                key='full-backup2s3.heartbeat',
-                value=1,
-                config_file=zab_conf['config_file']
-            )
+        zab_batcher.add(key='full-backup2s3.heartbeat', value=1)
+        zab_batcher.flush()
 
         logger.info('Starting backup')
 
         try:
+            load_tableau_env()
             tsm_exit_code, tsm_stdout, tsm_stderr, tsm_backup_duration = start_backup(
                 backup_file=backup_conf['backup_file'],
-                append_timestamp=backup_conf.getboolean('append_timestamp'),
-                multithreaded=backup_conf.getboolean('multithreaded')
+                append_timestamp=backup_conf.get('append_timestamp', False),
+                multithreaded=backup_conf.get('multithreaded', False),
+                zab_batcher=zab_batcher,
             )
         except Exception as exp:
             logger.error('Error while start_backup')
@@ -254,28 +513,18 @@ def main():
             raise exp
 
 
-        tsm_backup_result_code = 0 if 'Backup written to ' in tsm_stdout else 1
+        tsm_backup_result_code = 0 if b'Backup written to ' in tsm_stdout else 1
+        tsm_stdout = tsm_stdout[-TSM_LOG_TAIL_BYTES:].decode(errors='replace')
+        tsm_stderr = tsm_stderr[-TSM_LOG_TAIL_BYTES:].decode(errors='replace')
 
         logger.debug(f'{tsm_stdout=},\n {tsm_stderr=},\n {tsm_exit_code=}')
         logger.info(f'{tsm_backup_duration=} sec,\n {tsm_backup_result_code=}')
 
-        if zab_conf:
-            if tsm_backup_result_code == 0:
-                send_to_zabbix(
-                    key='full-backup2s3.tsm.backup_duration',
-                    value=int(tsm_backup_duration),
-                    config_file=zab_conf['config_file']
-                )
-            send_to_zabbix(
-                key='full-backup2s3.tsm.backup_result_code',
-                value=tsm_backup_result_code,
-                config_file=zab_conf['config_file']
-            )
-            send_to_zabbix(
-                key='full-backup2s3.tsm.exit_code',
-                value=tsm_exit_code,
-                config_file=zab_conf['config_file']
-            )
+        if tsm_backup_result_code == 0:
+            zab_batcher.add(key='full-backup2s3.tsm.backup_duration', value=int(tsm_backup_duration))
+        zab_batcher.add(key='full-backup2s3.tsm.backup_result_code', value=tsm_backup_result_code)
+        zab_batcher.add(key='full-backup2s3.tsm.exit_code', value=tsm_exit_code)
+        zab_batcher.flush()
 
         if tsm_backup_result_code != 0:
             logger.error('tsm exit code isn\'t zero:\n' + tsm_stdout + tsm_stderr)
@@ -283,54 +532,64 @@ def main():
     # UPLOAD
     logger.info('Starting upload')
     if sys.argv[1] in ['backup', 'upload']:
+        parallel_files = backup_conf.get('parallel_files', PARALLEL_FILES_DEFAULT)
         try:
-            s3_wrapper = S3Wrapper()
+            s3_wrapper = S3Wrapper(
+                max_concurrency=aws_conf.get('max_concurrency'),
+                part_size_mb=aws_conf.get('part_size_mb'),
+                parallel_files=parallel_files,
+            )
         except Exception as exp:
             logger.error('Error while init S3Wrapper')
             logger.exception(exp)
             raise exp
+        s3_wrapper.warm_up(bucket=aws_conf['bucket_name'])
         backup_dir = backup_conf['backup_dir']
-        for dir_entry in os.scandir(backup_dir):
-            if dir_entry.is_file() and dir_entry.name.endswith('.tsbak'):
-                backup_file_size = int(os.stat(dir_entry.path).st_size)
-                upload_result_code = 0
-                upload_duration = 0
-                logger.info(f'Uploading file "{dir_entry.name}", '
-                            f'size: {int(backup_file_size / (1024 * 1024))} MB '
-                            f'to {aws_conf["bucket_name"]}')
-                start_upload_time = time.time()
-                try:
-                    s3_wrapper.upload_file_with_md5sum(
-                        file=dir_entry.path,
-                        bucket=aws_conf['bucket_name'],
-                        key=dir_entry.name,
-                    )
-                except Exception as e:
-                    logger.error('Error while upload_file_with_md5sum')
-                    logger.exception(e)
-                    # logger.error(e)
-                    upload_result_code = 1
-                else:
-                    upload_duration = int(time.time() - start_upload_time)
-                    logger.info(f'Remove: {dir_entry.path}')
-                    os.remove(dir_entry.path)
-
-                if zab_conf and not upload_result_code:
-                    send_to_zabbix(
-                        key='full-backup2s3.backup_file_size',
-                        value=backup_file_size,
-                        config_file=zab_conf['config_file']
-                    )
-                    send_to_zabbix(
-                        key='full-backup2s3.upload_result_code',
-                        value=upload_result_code,
-                        config_file=zab_conf['config_file']
-                    )
-                    send_to_zabbix(
-                        key='full-backup2s3.upload_duration',
-                        value=upload_duration,
-                        config_file=zab_conf['config_file']
-                    )
+
+        def _upload_one(dir_entry: os.DirEntry, backup_file_size: int) -> None:
+            upload_result_code = 0
+            upload_duration = 0
+            logger.info(f'Uploading file "{dir_entry.name}", '
+                        f'size: {int(backup_file_size / (1024 * 1024))} MB '
+                        f'to {aws_conf["bucket_name"]}')
+            start_upload_time = time.time()
+            try:
+                s3_wrapper.upload_file_with_sha256sum(
+                    file=dir_entry.path,
+                    bucket=aws_conf['bucket_name'],
+                    key=dir_entry.name,
+                    sha256sum_file=not backup_conf.get('s3_native_checksum', True),
+                )
+            except Exception as e:
+                logger.error(f'Error while upload_file_with_sha256sum: "{dir_entry.name}"')
+                logger.exception(e)
+                upload_result_code = 1
+            else:
+                upload_duration = int(time.time() - start_upload_time)
+                logger.info(f'Remove: {dir_entry.path}')
+                os.remove(dir_entry.path)
+
+            if not upload_result_code:
+                zab_batcher.add(key='full-backup2s3.backup_file_size', value=backup_file_size)
+                zab_batcher.add(key='full-backup2s3.upload_result_code', value=upload_result_code)
+                zab_batcher.add(key='full-backup2s3.upload_duration', value=upload_duration)
+                zab_batcher.flush()
+
+        # Limits the number of submitted tasks so scandir is consumed only as fast as files are uploaded
+        in_flight = threading.BoundedSemaphore(parallel_files * 2)
+        futures = {}
+        with ThreadPoolExecutor(max_workers=parallel_files) as tpe, os.scandir(backup_dir) as dir_entries:
+            for entry in dir_entries:
+                if entry.is_file() and entry.name.endswith('.tsbak'):
+                    in_flight.acquire()
+                    future = tpe.submit(_upload_one, entry, entry.stat().st_size)
+                    future.add_done_callback(lambda _: in_flight.release())
+                    futures[future] = entry
+            for future in as_completed(futures):
+                if future.exception():
+                    logger.error(f'Error while uploading "{futures[future].name}"')
+                    logger.exception(future.exception())
+    zab_batcher.flush()
     logger.info('End')
 
 
@@ -0,0 +1,88 @@
+import hashlib
+import logging
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import full_backup2s3  # noqa: E402
+
+moto = pytest.importorskip('moto')
+
+BUCKET = 'backups'
+THRESHOLD = full_backup2s3.MULTIPART_THRESHOLD_MB * 1024 * 1024
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    with moto.mock_aws():
+        s3_wrapper = full_backup2s3.S3Wrapper()
+        s3_wrapper.s3_client.create_bucket(Bucket=BUCKET)
+        yield s3_wrapper
+
+
+def test_hashing_reader_close_keeps_file_open(tmp_path):
+    file = tmp_path / 'ts_backup.tsbak'
+    file.write_bytes(b'data')
+    with open(file, 'rb') as f:
+        reader = full_backup2s3.HashingReader(f, hashlib.sha256())
+        reader.read()
+        reader.close()
+        assert not f.closed
+        assert reader.hexdigest() == hashlib.sha256(b'data').hexdigest()
+
+
+@pytest.mark.parametrize('size', [0, 1000, THRESHOLD - 1, THRESHOLD, THRESHOLD + 1])
+def test_upload_file_with_sha256sum(s3, tmp_path, size):
+    data = os.urandom(size)
+    file = tmp_path / 'ts_backup.tsbak'
+    file.write_bytes(data)
+
+    sha256sum = s3.upload_file_with_sha256sum(
+        file=str(file),
+        bucket=BUCKET,
+        key=file.name,
+        sha256sum_file=True,
+    )
+
+    expected = f'{hashlib.sha256(data).hexdigest()}  {file.name}\n'
+    assert sha256sum == expected
+    assert s3.s3_client.get_object(Bucket=BUCKET, Key=file.name)['Body'].read() == data
+    sidecar = s3.s3_client.get_object(Bucket=BUCKET, Key=f'{file.name}.sha256.txt')['Body'].read()
+    assert sidecar.decode() == expected
+
+
+def test_start_backup_without_tsm(monkeypatch):
+    monkeypatch.setenv('PATH', '')
+
+    returncode, stdout, stderr, _ = full_backup2s3.start_backup(backup_file='ts_backup')
+
+    assert returncode == 127
+    assert stdout == b''
+    assert b'tsm' in stderr
+
+
+@pytest.mark.parametrize('max_concurrency', [None, 3])
+def test_fileobj_upload_keeps_max_concurrency_parts_in_memory(s3, max_concurrency):
+    s3_wrapper = full_backup2s3.S3Wrapper(max_concurrency=max_concurrency)
+
+    expected = max_concurrency or full_backup2s3.MAX_CONCURRENCY_DEFAULT
+    assert s3_wrapper.fileobj_transfer_config.max_in_memory_upload_chunks == expected
+    assert full_backup2s3.TRANSFER_CFG.max_in_memory_upload_chunks == 10
+
+
+def test_load_tableau_env_with_failing_profile(monkeypatch, tmp_path, caplog):
+    profile = tmp_path / 'tableau_server.sh'
+    profile.write_text('export TSM_TEST_VAR=loaded\nfalse\n')
+    monkeypatch.setenv('TSM_TEST_VAR', 'not loaded')
+
+    with caplog.at_level(logging.WARNING):
+        full_backup2s3.load_tableau_env(str(profile))
+
+    assert os.environ['TSM_TEST_VAR'] == 'loaded'
+    assert 'returned 1' in caplog.text
@@ -0,0 +1,196 @@
+import datetime
+import os
+import sys
+import time
+from queue import SimpleQueue
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tableauserverclient as TSC  # noqa: E402
+from tableauserverclient.models.workbook_item import WorkbookItem  # noqa: E402
+
+from wb_backup2s3 import core  # noqa: E402
+
+moto = pytest.importorskip('moto')
+
+BUCKET = 'backups'
+SITE = 'site'
+CREATED_AT = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def make_workbook(item_id: str, name: str, project_name: str) -> WorkbookItem:
+    wb = WorkbookItem(project_id='p1', name=name)
+    wb._id = item_id
+    wb._project_name = project_name
+    wb._created_at = CREATED_AT
+    wb._updated_at = CREATED_AT
+    wb._size = 1
+    wb.owner_id = 'u1'
+    return wb
+
+
+class FakeEndpoint:
+    def __init__(self, items):
+        self.items = items
+        self.req_options = None
+
+    def get(self, req_options=None):
+        self.req_options = req_options
+        pagination = SimpleNamespace(page_number=1, page_size=len(self.items), total_available=len(self.items))
+        return self.items, pagination
+
+    __call__ = get
+
+
+class FakeServer:
+    """Tableau server with one site and one project.
+
+    Downloads of "wb-download-fails" always fail, also without the extract.
+    """
+    download_fails = {'wb-download-fails'}
+    project_name = 'Root'
+    extra_workbooks = 0
+
+    def __init__(self, server_address=None, use_server_version=True):
+        self.http_options = {}
+        self.auth = SimpleNamespace(sign_in=lambda auth: None, switch_site=lambda site: None)
+        self.sites = FakeEndpoint([SimpleNamespace(name=SITE, content_url=SITE, id='s1')])
+        self.users = FakeEndpoint([SimpleNamespace(id='u1', name='user')])
+        self.projects = FakeEndpoint([SimpleNamespace(id='p1', name=self.project_name, parent_id=None)])
+        self.workbooks = FakeEndpoint([
+            make_workbook('wb-ok', 'Ok', self.project_name),
+            make_workbook('wb-download-fails', 'DownloadFails', self.project_name),
+            make_workbook('wb-upload-fails', 'UploadFails', self.project_name),
+        ] + [
+            make_workbook(f'wb-extra-{i}', f'Extra{i}', self.project_name) for i in range(self.extra_workbooks)
+        ])
+        self.workbooks.download = self._download
+        self.datasources = FakeEndpoint([])
+
+    def _download(self, workbook_id, include_extract=True, filepath=None):
+        if workbook_id in self.download_fails:
+            raise RuntimeError(f'download of {workbook_id} failed')
+        file_path = filepath + '.twbx'
+        with open(file_path, 'wb') as f:
+            f.write(b'workbook')
+        return file_path
+
+
+@pytest.fixture
+def project_name():
+    return 'Root'
+
+
+@pytest.fixture
+def extra_workbooks():
+    return 0
+
+
+@pytest.fixture
+def wb2s3(monkeypatch, tmp_path, project_name, extra_workbooks):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.setattr(FakeServer, 'project_name', project_name)
+    monkeypatch.setattr(FakeServer, 'extra_workbooks', extra_workbooks)
+    monkeypatch.setattr(TSC, 'Server', FakeServer)
+    monkeypatch.setattr(TSC, 'TableauAuth', lambda username, password: None)
+    # Failed downloads are retried without the backoff delays
+    monkeypatch.setattr(
+        core.BackupWB2S3,
+        '_ts_download_item',
+        core.retry(base=0, jitter=0)(core.BackupWB2S3._ts_download_item.__wrapped__),
+    )
+    with moto.mock_aws():
+        wb2s3 = core.BackupWB2S3(
+            tableau_cred=('user', 'password', 'https://tableau'),
+            work_dir=str(tmp_path),
+            failed_q=SimpleQueue(),
+            successful_q=SimpleQueue(),
+        )
+        wb2s3.s3_client.create_bucket(Bucket=BUCKET)
+        original_s3_upload = wb2s3._s3_upload
+        wb2s3.files_in_work_dir = []
+
+        def s3_upload(file_path, object_key, tags=None):
+            wb2s3.files_in_work_dir.append(len(os.listdir(tmp_path)))
+            if 'UploadFails' in object_key:
+                raise RuntimeError(f'upload of {object_key} failed')
+            if 'Extra' in object_key:
+                # Uploads are slower than downloads, downloaded files pile up without backpressure
+                time.sleep(0.02)
+            return original_s3_upload(file_path=file_path, object_key=object_key, tags=tags)
+
+        monkeypatch.setattr(wb2s3, '_s3_upload', s3_upload)
+        yield wb2s3
+
+
+def drain(q: SimpleQueue) -> list:
+    items = []
+    while not q.empty():
+        items.append(q.get())
+    return items
+
+
+def test_backup_site_reports_failed_items(wb2s3, tmp_path):
+    queued = wb2s3.backup_site(site_name=SITE, max_workers=2, s3_bucket_name=BUCKET)
+
+    assert queued == 3
+    failed = {backup_item.id: exc for exc, backup_item in drain(wb2s3.failed_q)}
+    assert set(failed) == {'wb-download-fails', 'wb-upload-fails'}
+    assert 'download of wb-download-fails failed' in str(failed['wb-download-fails'])
+    assert 'upload of site/Root/UploadFails.twbx failed' in str(failed['wb-upload-fails'])
+    assert [i.id for i in drain(wb2s3.successful_q)] == ['wb-ok']
+
+    assert os.listdir(tmp_path) == []
+
+    assert set(wb2s3.upload_state) == {'site/Root/Ok'}
+    keys = {i['Key'] for i in wb2s3.s3_client.list_objects_v2(Bucket=BUCKET)['Contents']}
+    assert keys == {'site/Root/Ok.twbx', 'site/' + wb2s3.s3_upload_state_file}
+
+
+@pytest.mark.parametrize('project_name, server_filter', [
+    ('Root', True),
+    # TSC would send it as [Fin\\Ops], which matches nothing on the server
+    ('Fin\\Ops', False),
+])
+def test_backup_site_project_name_filter(wb2s3, project_name, server_filter):
+    wb2s3.backup_site(site_name=SITE, max_workers=2, s3_bucket_name=BUCKET, projects=[project_name])
+
+    assert bool(list(wb2s3.ts.workbooks.req_options.filter)) == server_filter
+    assert set(wb2s3.upload_state) == {f'{SITE}/{project_name}/Ok'}
+
+
+@pytest.mark.parametrize('extra_workbooks', [20])
+def test_backup_site_limits_downloaded_files(wb2s3, tmp_path, extra_workbooks):
+    wb2s3.backup_site(
+        site_name=SITE,
+        max_workers=4,
+        download_workers=4,
+        upload_workers=1,
+        s3_bucket_name=BUCKET,
+    )
+
+    # A file is downloaded only when one of download_workers + upload_workers slots is free
+    assert max(wb2s3.files_in_work_dir) <= 5
+    assert len(drain(wb2s3.successful_q)) == extra_workbooks + 1
+    assert os.listdir(tmp_path) == []
+
+
+def test_s3_is_object_exists(wb2s3):
+    wb2s3.bucket_name = BUCKET
+    wb2s3.s3_client.put_object(Bucket=BUCKET, Key=f'{SITE}/Root/Other.twbx', Body=b'workbook')
+
+    # No site is switched to yet, S3 is asked directly
+    assert wb2s3._s3_is_object_exists(f'{SITE}/Root/Other.twbx')
+
+    wb2s3.backup_site(site_name=SITE, max_workers=2, s3_bucket_name=BUCKET)
+    assert wb2s3._s3_is_object_exists(f'{SITE}/Root/Ok.twbx')
+    assert not wb2s3._s3_is_object_exists(f'{SITE}/Root/UploadFails.twbx')
+
+    wb2s3.s3_client.delete_object(Bucket=BUCKET, Key=f'{SITE}/Root/Ok.twbx')
+    assert wb2s3._s3_is_object_exists(f'{SITE}/Root/Ok.twbx')
+    assert not wb2s3._s3_is_object_exists(f'{SITE}/Root/Ok.twbx', use_cache=False)
@@ -7,8 +7,10 @@ import sys
 import tomllib
 import hvac
 import re
+import tempfile
 from zabbix_utils import Sender as ZabbixSender
 from queue import SimpleQueue
+from concurrent.futures import ThreadPoolExecutor
 from wb_backup2s3 import BackupWB2S3, SENTRY_DENYLIST
 from sentry_sdk.scrubber import EventScrubber
 from sentry_sdk.integrations.logging import LoggingIntegration
@@ -26,6 +28,8 @@ ZAB_KEY_UNBACKUPED = 'wb-backup2s3.unbackuped'
 ZAB_KEY_FILESSIZE = 'wb-backup2s3.backup_files_size'
 ZAB_KEY_BACKUPED = 'wb-backup2s3.backuped'
 
+ZAB_CONFIG_RE = re.compile(r'^(ServerActive|Hostname)=(.+)$', re.MULTILINE)
+
 SENTRY_LOGGING = LoggingIntegration(
     level=logging.DEBUG,  # Capture logs at DEBUG level and above
     event_level=logging.ERROR  # Send events to Sentry for ERROR and above
@@ -40,10 +44,13 @@ class ZabSender(object):
         self._stub = stub
         if not self._stub:
             self.logger = logging.getLogger('main.Zabbix_sender')
-            zabbix_config = open(config_file).read()
-            self._server = re.search(r'ServerActive=(.+)', zabbix_config).group(1)
+            with open(config_file) as f:
+                zabbix_config = {}
+                for m in ZAB_CONFIG_RE.finditer(f.read()):
+                    zabbix_config.setdefault(m.group(1), m.group(2).strip())
+            self._server = zabbix_config['ServerActive']
             self.logger.debug(f"self.server: {self._server}")
-            self._hostname = re.search(r'Hostname=(.+)', zabbix_config).group(1)
+            self._hostname = zabbix_config['Hostname']
             self._sender = ZabbixSender(server=self._server)
             self.logger.debug(f"self.hostname: {self._hostname}")
 
@@ -141,33 +148,71 @@ def main():
     failed_q = SimpleQueue()
     successful_q = SimpleQueue()
 
-    try:
-        wb2s3 = BackupWB2S3(
+    def new_wb2s3(work_dir: str = None) -> BackupWB2S3:
+        return BackupWB2S3(
             tableau_cred=(ts_creds['username'], ts_creds['password'], ts_creds['url']),
-            work_dir=config['main']['workdir'],
+            work_dir=work_dir or config['main']['workdir'],
             failed_q=failed_q,
             successful_q=successful_q
         )
+
+    try:
+        wb2s3 = new_wb2s3()
     except Exception as exp:
         logger.error('Error while init BackupWB2S3')
         logger.exception(exp)
         raise exp
 
+    max_workers = config['main'].get('max_workers', MAX_WORKERS_DEFAULT)
+    download_workers = config['main'].get('download_workers', max_workers)
+    upload_workers = config['main'].get('upload_workers', max_workers)
+    touch_workers = config['main'].get('touch_workers', max_workers)
+
     if config['backup'].get('sites'):
         wb2s3.full_backup(
-            max_workers=config['main'].get('max_workers', MAX_WORKERS_DEFAULT),
+            max_workers=max_workers,
+            download_workers=download_workers,
+            upload_workers=upload_workers,
+            touch_workers=touch_workers,
             excluded_sites=config['backup']['sites'].get('excluded_sites', []),
             site_names= [os.environ['TS_SITE_NAME']] if 'TS_SITE_NAME' in  os.environ else None,
             s3_bucket_name = config['backup']['sites']['s3_bucket_name']
         )
 
-    for projects  in config.get('backup', {}).get('projects', []):
-        wb2s3.backup_site(
-            site_name=projects['site'],
-            max_workers=config['main'].get('max_workers', MAX_WORKERS_DEFAULT),
-            projects=projects['projects'],
-            s3_bucket_name=projects['bucket'],
-        )
+    # Entries with the same site and bucket share upload_state.json, so they are backed up one by one
+    projects_groups = {}
+    for projects in config.get('backup', {}).get('projects', []):
+        projects_groups.setdefault((projects['site'], projects['bucket']), []).append(projects)
+    groups_workers = max(1, min(len(projects_groups), max_workers))
+    if groups_workers > 1 and not wb2s3.user_id_username:
+        wb2s3._fill_user_id_username()
+
+    def backup_projects_group(group: list, group_wb2s3: BackupWB2S3):
+        for projects in group:
+            group_wb2s3.backup_site(
+                site_name=projects['site'],
+                max_workers=max(1, max_workers // groups_workers),
+                download_workers=max(1, download_workers // groups_workers),
+                upload_workers=max(1, upload_workers // groups_workers),
+                touch_workers=max(1, touch_workers // groups_workers),
+                projects=projects['projects'],
+                s3_bucket_name=projects['bucket'],
+            )
+
+    def backup_projects_group_in_parallel(group: list):
+        # BackupWB2S3 keeps the state of the current site, each parallel group needs its own instance.
+        # Groups of the same site can back up the same item, so each one downloads into its own work_dir
+        with tempfile.TemporaryDirectory(dir=config['main']['workdir']) as group_work_dir:
+            group_wb2s3 = new_wb2s3(work_dir=group_work_dir)
+            group_wb2s3.user_id_username = wb2s3.user_id_username
+            backup_projects_group(group, group_wb2s3)
+
+    if groups_workers == 1:
+        for group in projects_groups.values():
+            backup_projects_group(group, wb2s3)
+    else:
+        with ThreadPoolExecutor(max_workers=groups_workers) as tpe:
+            list(tpe.map(backup_projects_group_in_parallel, projects_groups.values()))
 
     zab_sender.send(ZAB_KEY_UNBACKUPED, str(failed_q.qsize()))
     if not failed_q.empty():
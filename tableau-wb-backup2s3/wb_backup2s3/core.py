@@ -3,16 +3,21 @@ from operator import itemgetter
 import boto3
 import logging
 import os
+import random
+import string
 import botocore
+import botocore.config
 import datetime
-import json
 import sentry_sdk
 import functools
-import re
+import orjson
+import threading
+import time
 from dataclasses import dataclass
 from urllib import parse
 import tableauserverclient as TSC
-from concurrent.futures import ThreadPoolExecutor
+from boto3.s3.transfer import TransferConfig
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
 from queue import SimpleQueue
 from tableauserverclient.models.workbook_item import WorkbookItem
 from tableauserverclient.models.datasource_item import DatasourceItem
@@ -30,6 +35,19 @@ SENTRY_DENYLIST = DEFAULT_DENYLIST + [
     'tableau_cred',
 ]
 
+# Extracts can be GBs, upload and copy them in parts by several threads
+_TRANSFER_CFG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=16 * 1024 * 1024,
+    max_concurrency=10,
+    use_threads=True,
+)
+
+# Characters allowed in S3 tag values as-is: [а-яА-Яa-zA-Z0-9 +\-=\.:/@]
+_S3_TAG_ALLOWED_CHARS = frozenset(
+    string.ascii_letters + string.digits + ' +-=.:/@' + ''.join(chr(c) for c in range(0x0410, 0x0450))
+)
+
 
 @dataclass
 class BackupItem:
@@ -40,19 +58,31 @@ class BackupItem:
     site: str
 
 
-def retry(_func=None, *, times=6):
+def _is_retryable(e: Exception) -> bool:
+    # S3 client errors (403, 404, ...) will fail the same way again, except timeout and throttling
+    if isinstance(e, botocore.exceptions.ClientError):
+        status = e.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+        return not (400 <= status < 500) or status in (408, 429)
+    return True
+
+
+def retry(_func=None, *, times=6, base=0.5, cap=30, jitter=0.5):
     def decorator_retry(func):
+        # Exponential backoff with jitter, gives throttling and network errors time to pass.
+        # No sleep after the last attempt
+        sleeps = [min(cap, base * 2 ** attempt) for attempt in range(times - 1)] + [None]
+
         @functools.wraps(func)
         def wrapper_retry(*args, **kwargs):
-            last_exception = None
-            for attempt in range(times):
+            for attempt, delay in enumerate(sleeps, start=1):
                 try:
                     return func(*args, **kwargs)
                 except Exception as e:
-                    last_exception = e
-                    logger.debug(f"  Attempt {attempt + 1} failed: {e}. Retrying...")
-            logger.debug("  Function failed after maximum retry attempts.")
-            raise last_exception
+                    if delay is None or not _is_retryable(e):
+                        logger.debug(f"  Attempt {attempt} failed: {e}. Function failed after {attempt} attempts.")
+                        raise
+                    logger.debug(f"  Attempt {attempt} failed: {e}. Retrying...")
+                    time.sleep(delay + random.uniform(0, jitter))
         return wrapper_retry
     if _func is None:
         return decorator_retry
@@ -91,6 +121,8 @@ class BackupWB2S3:
     _time_format = '%Y-%m-%d %H:%M:%S%z'
     _date_format = '%Y-%m-%d'
     _download_error_ignore_tag = 'WBBackupIgnoreErrors'
+    _ts_page_size = 1000  # max page size of the Tableau REST API
+    _ts_filter_max_names = 100  # keeps the request URL short
 
     def __init__(
             self,
@@ -99,6 +131,7 @@ class BackupWB2S3:
             failed_q: SimpleQueue = None,
             successful_q: SimpleQueue = None,
             ts_http_timeout: int = 1200,
+            s3_max_pool_connections: int = 100,
     ):
 
         self.logger = logging.getLogger(self.loger_name)
@@ -106,9 +139,14 @@ class BackupWB2S3:
         self.successful_q = successful_q if successful_q else SimpleQueue()
         self.work_dir = work_dir
         self.current_site_name = None
+        self._site_prefix: str = None
         self.project_id_path: dict = {}
+        self._path_to_project_id: dict = {}
+        self._project_id_name: dict = {}
         self.projects_hierarchy: dict = {}
         self.user_id_username = None
+        self._ts_sites: dict = None
+        self._current_site_objects: dict = None
         self.bucket_name: dict = {}
         self.upload_state = {}
         self.wb_name_s3_object = {}
@@ -135,60 +173,104 @@ class BackupWB2S3:
             )
         )
 
-        self.s3_client = boto3.client(
+        # The default boto3 session isn't thread-safe, instances are created in parallel by vcli
+        self._boto3_session = boto3.session.Session()
+        self._s3_init_clients(s3_max_pool_connections)
+        # self.logger.debug(f"{boto3.client("sts").get_caller_identity()=}")
+
+    def _s3_init_clients(self, max_pool_connections: int):
+        s3_cfg = botocore.config.Config(
+            max_pool_connections=max_pool_connections,
+            tcp_keepalive=True,
+            retries={'max_attempts': 6, 'mode': 'adaptive'},
+        )
+        self.s3_client = self._boto3_session.client(
             service_name='s3',
+            config=s3_cfg,
         )
-
-        self.s3_resource = boto3.resource(
+        self.s3_resource = self._boto3_session.resource(
             service_name='s3',
+            config=s3_cfg,
         )
-        # self.logger.debug(f"{boto3.client("sts").get_caller_identity()=}")
+        self._s3_max_pool_connections = max_pool_connections
+
+    def _s3_fit_pool(self, upload_workers: int, touch_workers: int):
+        # Every upload thread runs up to _TRANSFER_CFG.max_concurrency S3 requests. A smaller pool
+        # makes botocore discard connections and open new TLS sessions
+        max_pool_connections = max(upload_workers * _TRANSFER_CFG.max_concurrency, touch_workers)
+        if max_pool_connections > self._s3_max_pool_connections:
+            self.logger.debug(f'Grow S3 connection pool to {max_pool_connections}')
+            self._s3_init_clients(max_pool_connections)
 
     def _get_ts_item_path(self, ts_item):
-        return self.current_site_name + '/' + self.project_id_path[ts_item.project_id] + ts_item.name
+        return self._site_prefix + self.project_id_path[ts_item.project_id] + ts_item.name
 
     def _fill_user_id_username(self):
-        ts_users = []
+        user_id_username = {}
         for site in self._ts_get_all_sites():
             self.ts.auth.switch_site(site)
-            ts_users += list(TSC.Pager(self.ts.users))
-        self.user_id_username = {i.id: i.name for i in ts_users}
+            req_options = TSC.RequestOptions(pagesize=self._ts_page_size)
+            user_id_username.update({i.id: i.name for i in TSC.Pager(self.ts.users, request_opts=req_options)})
+        self.user_id_username = user_id_username
 
     def _build_project_structure(self):
-        all_projects = list(TSC.Pager(self.ts.projects))
-        all_projects = {i.id: i for i in all_projects}
+        req_options = TSC.RequestOptions(pagesize=self._ts_page_size)
+        all_projects = {i.id: i for i in TSC.Pager(self.ts.projects, request_opts=req_options)}
+        project_id_path = {}
+        projects_hierarchy = {}
+
+        def get_path(project_id: str) -> str:
+            # The path of a project is built from the cached path of its parent
+            if project_id not in project_id_path:
+                project = all_projects[project_id]
+                parent_path = get_path(project.parent_id) if project.parent_id else ''
+                project_id_path[project_id] = parent_path + project.name + '/'
+            return project_id_path[project_id]
+
         for project in all_projects.values():
-            parent_id = project.parent_id
-            self.projects_hierarchy.setdefault(parent_id,[]).append(project.id)
-            path = []
-            while True:
-                if parent_id:
-                    path.append(all_projects[parent_id].name)
-                    parent_id = all_projects[parent_id].parent_id
-                else:
-                    break
-            path.reverse()
-            self.project_id_path[project.id] = '/'.join(path + [project.name]) + '/'
+            projects_hierarchy.setdefault(project.parent_id, []).append(project.id)
+            get_path(project.id)
+        self.project_id_path = project_id_path
+        self._path_to_project_id = {v: k for k, v in project_id_path.items()}
+        self._project_id_name = {k: v.name for k, v in all_projects.items()}
+        self.projects_hierarchy = projects_hierarchy
+
+    @staticmethod
+    def _ts_filter_safe_name(name: str) -> bool:
+        # TSC sends the "in" filter as str(list) without quotes, so a name is sent as its repr().
+        # Names which repr() escapes (quotes, backslashes, control chars) would match nothing
+        return repr(name) == "'" + name + "'" and not any(c in name for c in '",[]')
 
     def _get_sub_projects(self, project_id: str):
         resp = []
-        if self.projects_hierarchy.get(project_id):
-            resp.extend(self.projects_hierarchy.get(project_id))
-        for sub_project_id in self.projects_hierarchy.get(project_id, []):
-            resp.extend(self._get_sub_projects(sub_project_id))
+        stack = [project_id]
+        while stack:
+            sub_project_ids = self.projects_hierarchy.get(stack.pop())
+            if sub_project_ids:
+                resp.extend(sub_project_ids)
+                stack.extend(sub_project_ids)
         return resp
 
+    def _ts_get_all_sites(self, refresh: bool = False):
+        # Sites are paged once per run, they are needed by every backup_site call
+        if refresh or self._ts_sites is None:
+            self._ts_sites = {i.name: i for i in TSC.Pager(self.ts.sites.get)}
+        return list(self._ts_sites.values())
 
-    def _ts_get_all_sites(self):
-        return list(TSC.Pager(self.ts.sites.get))
+    def _ts_get_site(self, site_name: str):
+        if self._ts_sites is None:
+            self._ts_get_all_sites()
+        return self._ts_sites.get(site_name)
 
     def _ts_switch_site(self, site_name: str):
-        site = [i for i in self._ts_get_all_sites() if i.name == site_name]
+        site = self._ts_get_site(site_name)
         if site:
-            self.logger.debug(f'Switch to:"{site[0].name}", url: "{site[0].content_url}"')
-            self.ts.auth.switch_site(site[0])
+            self.logger.debug(f'Switch to:"{site.name}", url: "{site.content_url}"')
+            self.ts.auth.switch_site(site)
 
-            self.current_site_name = site[0].name
+            self.current_site_name = site.name
+            self._site_prefix = site.name + '/'
+            self._current_site_objects = None
             self._s3_download_upload_state()
             self._build_project_structure()
         else:
@@ -215,9 +297,8 @@ class BackupWB2S3:
         raise Exception("Unsupported type")
 
     @print_and_send_exceptions_sentry
-    def _do_backup(self, item, include_extract: bool = True):
-        item_path = self._get_ts_item_path(item)
-
+    def _do_download(self, item) -> tuple[str, bool]:
+        include_extract = True
         try:
             file_path = self._ts_download_item(
                 item=item,
@@ -230,32 +311,51 @@ class BackupWB2S3:
                 item=item,
                 include_extract=include_extract
             )
+        return file_path, include_extract
 
+    @print_and_send_exceptions_sentry
+    def _do_upload(self, item, item_path: str, file_path: str, include_extract: bool):
         obj_key = item_path + '.' + file_path[-7:].split('.')[1]
+        created_at = item.created_at.strftime(self._time_format)
+        updated_at = item.updated_at.strftime(self._time_format)
         tags = {
             'tab_owner': self.user_id_username.get(item.owner_id),
             'tab_id': item.id,
-            'tab_created_at': item.created_at.strftime(self._time_format),
-            'tab_updated_at': item.updated_at.strftime(self._time_format),
+            'tab_created_at': created_at,
+            'tab_updated_at': updated_at,
             'tab_description': self.convert_to_s3_compliant_tag(item.description)[:256] if item.description else '',
         }
-        self._s3_upload(
-            file_path=file_path,
-            object_key=obj_key,
-            tags=tags
-        )
+        try:
+            self._s3_upload(
+                file_path=file_path,
+                object_key=obj_key,
+                tags=tags
+            )
+        finally:
+            # A failed upload must not leave the downloaded file in work_dir
+            os.remove(file_path)
         if include_extract or self._download_error_ignore_tag in item.tags:
             self.upload_state[item_path] = {
                 'id': item.id,
                 'name': item.name,
-                'created_at': item.created_at.strftime(self._time_format),
-                'updated_at': item.updated_at.strftime(self._time_format),
+                'created_at': created_at,
+                'updated_at': updated_at,
                 'upload_date': datetime.date.today().strftime(self._date_format),
                 'object_key': obj_key,
             }
-        os.remove(file_path)
 
-    def _backup_item(self, item):
+    def _backup_item(
+            self,
+            item,
+            item_path: str,
+            upload_tpe: ThreadPoolExecutor,
+            backup_slots: threading.BoundedSemaphore,
+    ) -> Future | None:
+        """Downloads the item and submits its upload to upload_tpe.
+
+        A slot of backup_slots is held from the download until the end of the upload,
+        so the number of downloaded files waiting for upload in work_dir is limited.
+        """
         backup_item = BackupItem(
             name=item.name,
             project=item.project_name,
@@ -264,19 +364,71 @@ class BackupWB2S3:
             site=self.current_site_name,
         )
         self.logger.info(f'Backup "{item.project_name}"/"{item.name}" ({item.id}), {item.size} MB"')
+        backup_slots.acquire()
+        with sentry_sdk.new_scope() as scope:
+            scope.add_breadcrumb(
+                category='_backup',
+                message=f'Download(project / wb (id)): {item.project_name} / {item.name} ({item.id})',
+                level='info',
+                type='debug',
+            )
+            try:
+                file_path, include_extract = self._do_download(item)
+            except Exception as e:
+                backup_slots.release()
+                self.failed_q.put((e, backup_item))
+                return None
+        return upload_tpe.submit(
+            self._upload_item, item, item_path, backup_item, file_path, include_extract, backup_slots
+        )
+
+    def _upload_item(
+            self,
+            item,
+            item_path: str,
+            backup_item: BackupItem,
+            file_path: str,
+            include_extract: bool,
+            backup_slots: threading.BoundedSemaphore,
+    ):
         with sentry_sdk.new_scope() as scope:
             scope.add_breadcrumb(
                 category='_backup',
-                message=f'Backup(project / wb (id)): {item.project_name} / {item.name} ({item.id})',
+                message=f'Upload(project / wb (id)): {item.project_name} / {item.name} ({item.id})',
                 level='info',
                 type='debug',
             )
             try:
-                self._do_backup(item)
+                self._do_upload(item, item_path, file_path, include_extract)
             except Exception as e:
                 self.failed_q.put((e, backup_item))
             else:
                 self.successful_q.put(backup_item)
+            finally:
+                backup_slots.release()
+
+    @staticmethod
+    def _submit_windowed(tpe: ThreadPoolExecutor, fn, args_iter, window: int):
+        """Submits fn(*args) for every args of args_iter and yields the futures as they complete.
+
+        Not more than `window` futures are pending at the same time, the next task is submitted
+        when one of them completes.
+        """
+        pending = set()
+        for args in args_iter:
+            if len(pending) >= window:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                yield from done
+            pending.add(tpe.submit(fn, *args))
+        yield from as_completed(pending)
+
+    def _handle_future_exception(self, future: Future) -> bool:
+        if future.exception():
+            self.logger.exception(future.exception())
+            self.failed_q.put((future.exception(), None))
+            sentry_sdk.capture_exception(future.exception())
+            return True
+        return False
 
     def full_backup(
             self,
@@ -284,7 +436,10 @@ class BackupWB2S3:
             site_names: list = None,
             last_modified_update_interval: int = 60,
             max_workers: int = 10,
-            excluded_sites: list = []
+            excluded_sites: list = [],
+            download_workers: int = None,
+            upload_workers: int = None,
+            touch_workers: int = None,
     ):
         self.logger.debug(f'Run run_sites_backup: {s3_bucket_name=}, {site_names=}, {excluded_sites=}, {last_modified_update_interval=}, {max_workers=}')
         ts_sites = [s for s in self._ts_get_all_sites() if s.name not in excluded_sites]
@@ -298,6 +453,9 @@ class BackupWB2S3:
                 max_workers=max_workers,
                 s3_bucket_name = s3_bucket_name,
                 last_modified_update_interval=last_modified_update_interval,
+                download_workers=download_workers,
+                upload_workers=upload_workers,
+                touch_workers=touch_workers,
             )
         return
 
@@ -308,37 +466,60 @@ class BackupWB2S3:
             s3_bucket_name: str,
             projects: list = [],
             last_modified_update_interval: int = 60,
+            download_workers: int = None,
+            upload_workers: int = None,
+            touch_workers: int = None,
     ):
+        # Downloads, uploads and last_modified updates (small S3 copies) are sized separately, max_workers is the default
+        download_workers = download_workers or max_workers
+        upload_workers = upload_workers or max_workers
+        touch_workers = touch_workers or max_workers
+        self._s3_fit_pool(upload_workers, touch_workers)
         self.logger.info(f'#Backup site: "{site_name}" in to "{s3_bucket_name}", {projects=}')
         if not self.user_id_username:
             self._fill_user_id_username()
         self.bucket_name = s3_bucket_name
         self._ts_switch_site(site_name)
 
-        project_ids_to_backup = []
+        project_ids_to_backup = set()
         if projects:
             self.logger.info(f'Backup only next projects: "{projects}"')
         for project_path in projects:
             if not project_path.endswith('/'):
                 project_path = project_path + '/'
 
-            if project_path not in self.project_id_path.values():
+            project_id = self._path_to_project_id.get(project_path)
+            if project_id is None:
                 self.logger.warning(f'Project "{project_path}" not found')
             else:
-                project_id = [k for k,v in self.project_id_path.items() if v == project_path][0]
-                project_ids_to_backup.append(project_id)
-                sub_projects = self._get_sub_projects(project_id)
-                if sub_projects:
-                    project_ids_to_backup.extend(sub_projects)
+                project_ids_to_backup.add(project_id)
+                project_ids_to_backup.update(self._get_sub_projects(project_id))
 
         queue_to_backup = []
 
-        all_wbs = list(TSC.Pager(self.ts.workbooks))
-        all_dss = list(TSC.Pager(self.ts.datasources))
+        req_options = TSC.RequestOptions(pagesize=self._ts_page_size)
+        if projects:
+            project_names = sorted({self._project_id_name[i] for i in project_ids_to_backup})
+            # Without the server-side filter all items are listed, projects with the same name
+            # in other parents are filtered out by id below in both cases
+            if 0 < len(project_names) <= self._ts_filter_max_names and all(
+                    self._ts_filter_safe_name(i) for i in project_names
+            ):
+                req_options.filter.add(TSC.Filter(
+                    TSC.RequestOptions.Field.ProjectName,
+                    TSC.RequestOptions.Operator.In,
+                    project_names,
+                ))
+        if projects and not project_ids_to_backup:
+            all_wbs, all_dss = [], []
+        else:
+            all_wbs = list(TSC.Pager(self.ts.workbooks, request_opts=req_options))
+            all_dss = list(TSC.Pager(self.ts.datasources, request_opts=req_options))
         if projects:
             all_wbs = [w for w in all_wbs if w.project_id in project_ids_to_backup]
             all_dss = [d for d in all_dss if d.project_id in project_ids_to_backup]
-        all_items_paths = [self._get_ts_item_path(w) for w in all_wbs] + [self._get_ts_item_path(d) for d in all_dss]
+        item_paths = {i.id: self._get_ts_item_path(i) for i in all_wbs + all_dss}
+        all_items_paths = set(item_paths.values())
 
         for item_path, item_data in [(k, v) for k, v in self.upload_state.items() if k not in all_items_paths]:
             self.logger.info(f'"{item_data['object_key']}" no longer exists on the TS. Update Last modified field in S3')
@@ -346,43 +527,57 @@ class BackupWB2S3:
             self.upload_state.pop(item_path)
 
         for item in all_dss + all_wbs:
-            item_path = self._get_ts_item_path(item)
+            item_path = item_paths[item.id]
+            updated_at = item.updated_at.strftime(self._time_format)
+            created_at = item.created_at.strftime(self._time_format)
 
-            if self.upload_state.get(item_path) and all([
-                self.upload_state[item_path]['id'] == item.id,
-                self.upload_state[item_path]['updated_at'] == item.updated_at.strftime(self._time_format),
-                self.upload_state[item_path]['created_at'] == item.created_at.strftime(self._time_format),
-            ]):
+            state = self.upload_state.get(item_path)
+            if state and state['id'] == item.id and state['updated_at'] == updated_at and state['created_at'] == created_at:
                 self.logger.debug(f'"{item_path}" already in S3 and has the same metadata. Ignore')
-            else:
-                if self.upload_state.get(item_path):
-                    msg_parts = []
-                    if self.upload_state[item_path]['id'] != item.id:
-                        msg_parts.append(f'wb id was changed: {self.upload_state[item_path]['id']} -> {item.id}')
-                    elif self.upload_state[item_path]['updated_at'] != item.updated_at.strftime(self._time_format):
-                        msg_parts.append(
-                            f'wb updated_at was changed: {self.upload_state[item_path]['updated_at']} -> {item.updated_at.strftime(self._time_format)}'
-                        )
-                    elif self.upload_state[item_path]['created_at'] == item.created_at.strftime(self._time_format):
-                        msg_parts.append(
-                            f'wb created_at was changed: {self.upload_state[item_path]['created_at']} -> {item.created_at.strftime(self._time_format)}'
-                        )
-                    self.logger.info(f'"{item_path}": ' + ' ,'.join(msg_parts))
-                queue_to_backup.append(item)
-
-        with ThreadPoolExecutor(max_workers=max_workers) as tpe:
-            resp = [tpe.submit(self._backup_item, item) for item in queue_to_backup]
-        for r in resp:
-            if r.exception():
-                self.logger.exception(r.exception())
-                self.failed_q.put((r.exception(), None))
-                sentry_sdk.capture_exception(r.exception())
-
-        self._s3_update_outdated_last_modified(last_modified_update_interval)
+                continue
+            if state:
+                msg_parts = []
+                if state['id'] != item.id:
+                    msg_parts.append(f'wb id was changed: {state['id']} -> {item.id}')
+                if state['updated_at'] != updated_at:
+                    msg_parts.append(f'wb updated_at was changed: {state['updated_at']} -> {updated_at}')
+                if state['created_at'] != created_at:
+                    msg_parts.append(f'wb created_at was changed: {state['created_at']} -> {created_at}')
+                self.logger.info(f'"{item_path}": ' + ', '.join(msg_parts))
+            queue_to_backup.append(item)
+
+        # Uploads run in their own pool, so the upload of one item overlaps with the download of the next
+        backup_slots = threading.BoundedSemaphore(download_workers + upload_workers)
+        upload_futures = set()
+        with ThreadPoolExecutor(max_workers=upload_workers) as upload_tpe:
+            with ThreadPoolExecutor(max_workers=download_workers) as download_tpe:
+                for r in self._submit_windowed(
+                        download_tpe,
+                        self._backup_item,
+                        ((item, item_paths[item.id], upload_tpe, backup_slots) for item in queue_to_backup),
+                        window=download_workers * 2,
+                ):
+                    if not self._handle_future_exception(r) and r.result():
+                        upload_futures.add(r.result())
+                    for done in [f for f in upload_futures if f.done()]:
+                        self._handle_future_exception(done)
+                        upload_futures.discard(done)
+            for r in as_completed(upload_futures):
+                self._handle_future_exception(r)
+
+        self._s3_update_outdated_last_modified(last_modified_update_interval, max_workers=touch_workers)
         self._s3_upload_upload_state()
         return len(queue_to_backup)
 
-    def _s3_is_object_exists(self, object_key):
+    def _s3_is_object_exists(self, object_key, use_cache: bool = True):
+        """Checks if the object exists in the current bucket.
+
+        Keys of the current site are looked up in the per-site listing cache (see _s3_get_current_site_objects),
+        which only knows about changes made by this instance. With use_cache=False, or for other keys,
+        S3 is asked with HeadObject.
+        """
+        if use_cache and self._site_prefix is not None and object_key.startswith(self._site_prefix):
+            return object_key in self._s3_get_current_site_objects()
         try:
             self.s3_client.head_object(Bucket=self.bucket_name, Key=object_key)
         except botocore.exceptions.ClientError as e:
@@ -392,7 +587,6 @@ class BackupWB2S3:
                 raise
         return True
 
-    @retry
     def _s3_upload(
             self,
             file_path: str,
@@ -409,43 +603,57 @@ class BackupWB2S3:
                 "Tagging": parse.urlencode(tags)
             }
         self.logger.info(f' upload: {object_key} to {self.bucket_name}')
-        self.s3_client.upload_file(**params)
+        self.s3_client.upload_file(**params, Config=_TRANSFER_CFG)
+        self._s3_set_current_site_object(object_key)
 
     def _s3_list_all_objects_in_curr_ts_site(self):
         paginator = self.s3_client.get_paginator('list_objects_v2')
-        response_iterator = paginator.paginate(Bucket=self.bucket_name)
+        response_iterator = paginator.paginate(Bucket=self.bucket_name, Prefix=self._site_prefix)
         all_objects = []
         for page in response_iterator:
             if 'Contents' in page:
-                all_objects += [i for i in page['Contents'] if i['Key'].startswith(self.current_site_name + '/')]
+                all_objects += page['Contents']
         return all_objects
 
+    def _s3_get_current_site_objects(self) -> dict:
+        """Returns {Key: LastModified} of the current site objects, S3 is listed once per site."""
+        if self._current_site_objects is None:
+            self._current_site_objects = {
+                i['Key']: i['LastModified'] for i in self._s3_list_all_objects_in_curr_ts_site()
+            }
+        return self._current_site_objects
+
+    def _s3_set_current_site_object(self, object_key: str):
+        if self._current_site_objects is not None:
+            self._current_site_objects[object_key] = datetime.datetime.now().astimezone()
+
     @staticmethod
     def convert_to_s3_compliant_tag(data: str, replacement_char='_'):
-        allowed_pattern = r'[а-яА-Яa-zA-Z0-9 +\-=\.:/@]'
-
         output = ''.join(
-            char if re.match(allowed_pattern, char) else replacement_char
+            char if char in _S3_TAG_ALLOWED_CHARS else replacement_char
             for char in data
         )
         return output
 
     def _s3_update_outdated_last_modified(self, days: int = 30, threads: bool = True, max_workers: int = 10):
         curr_date = datetime.datetime.now().astimezone()
-        all_object = self._s3_list_all_objects_in_curr_ts_site()
+        outdated_keys = [
+            k for k, last_modified in self._s3_get_current_site_objects().items()
+            if (curr_date - last_modified).days >= days
+        ]
 
         if threads:
             with ThreadPoolExecutor(max_workers=max_workers) as tpe:
-                resp = [tpe.submit(self._s3_update_last_modified, obj['Key']) for obj in
-                        [i for i in all_object if (curr_date - i['LastModified']).days >= days]]
-            for r in resp:
-                if r.exception():
-                    self.logger.exception(r.exception())
-                    self.failed_q.put((r.exception(), None))
-                    sentry_sdk.capture_exception(r.exception())
+                for r in self._submit_windowed(
+                        tpe,
+                        self._s3_update_last_modified,
+                        ((obj_key,) for obj_key in outdated_keys),
+                        window=max_workers * 2,
+                ):
+                    self._handle_future_exception(r)
         else:
-            for obj in [i for i in all_object if (curr_date - i['LastModified']).days >= days]:
-                self._s3_update_last_modified(obj['Key'])
+            for obj_key in outdated_keys:
+                self._s3_update_last_modified(obj_key)
 
     def _s3_update_last_modified(self, object_key: str):
         self.logger.debug(f'Update last_modified for {object_key}')
@@ -453,17 +661,19 @@ class BackupWB2S3:
         self.s3_resource.meta.client.copy(
             CopySource={'Bucket': self.bucket_name, 'Key': object_key},
             Bucket=self.bucket_name,
-            Key=object_key
+            Key=object_key,
+            Config=_TRANSFER_CFG,
         )
+        self._s3_set_current_site_object(object_key)
 
         # self.logger.debug(f's3.meta.client.copy resp: {resp}')
 
     @retry(times=3)
     def _s3_upload_upload_state(self):
-        obj_key = self.current_site_name + '/' + self.s3_upload_state_file
+        obj_key = self._site_prefix + self.s3_upload_state_file
         self.logger.info(f'Upload {obj_key} ')
         with sentry_sdk.new_scope() as scope:
-            upload_state = json.dumps(self.upload_state, indent=2)
+            upload_state = orjson.dumps(self.upload_state)
             scope.add_breadcrumb(
                 category='_s3_upload_upload_state',
                 message=f's3.put_object "{obj_key}" to "{self.bucket_name}"',
@@ -471,7 +681,7 @@ class BackupWB2S3:
                 type='debug',
             )
             scope.add_attachment(
-                bytes=upload_state.encode("utf-8"),
+                bytes=upload_state,
                 filename=obj_key
             )
             try:
@@ -480,12 +690,13 @@ class BackupWB2S3:
                     Bucket=self.bucket_name,
                     Key=obj_key
                 )
+                self._s3_set_current_site_object(obj_key)
             except Exception as e:
                 sentry_sdk.capture_exception(e)
                 raise
 
     def _s3_download_upload_state(self):
-        obj_key = self.current_site_name + '/' + self.s3_upload_state_file
+        obj_key = self._site_prefix + self.s3_upload_state_file
         self.logger.debug(f'Try to download {obj_key} ')
         with sentry_sdk.new_scope() as scope:
             scope.add_breadcrumb(
@@ -516,8 +727,7 @@ class BackupWB2S3:
 
             scope.add_attachment(bytes=resp_body, filename=self.s3_upload_state_file)
             try:
-                text = resp_body.decode()
-                self.upload_state = json.loads(text)
+                self.upload_state = orjson.loads(resp_body)
             except Exception as e:
                 sentry_sdk.capture_exception(e)
                 raise